@@ -46,3 +46,44 @@ class Page(object):
             self.item_count, self.page_count, self.page_index, self.page_size, self.offset, self.limit)
 
     __repr__ = __str__
+
+
+def encode_cursor(item):
+    """encode the (created_at, id) of item as a cursor string"""
+    return '%r-%s' % (item['created_at'], item['id'])
+
+
+def decode_cursor(cursor):
+    """decode cursor string to a (created_at, id) tuple"""
+    try:
+        created_at, id_ = cursor.split('-')
+        return float(created_at), id_
+    except ValueError:
+        raise APIValueError('cursor', 'Invalid cursor: %s' % cursor)
+
+
+class CursorPage(object):
+    """Page located by cursor (keyset pagination) instead of offset, item_count is optional"""
+    def __init__(self, items, page_size=10, after=None, before=None, item_count=None):
+        # items 是按 page_size + 1 查询的结果，多出的一条用于判断是否还有下一页
+        self.item_count = item_count
+        self.page_size = page_size
+        has_more = len(items) > page_size
+        del items[page_size:]
+        if before is not None:
+            items.reverse()
+            self.has_previous = has_more
+            self.has_next = True
+        else:
+            self.has_previous = after is not None
+            self.has_next = has_more
+        if not items:
+            self.has_previous = self.has_next = False
+        self.previous_cursor = encode_cursor(items[0]) if self.has_previous else None
+        self.next_cursor = encode_cursor(items[-1]) if self.has_next else None
+
+    def __str__(self):
+        return 'item_count: %s, page_size: %s, previous_cursor: %s, next_cursor: %s' % (
+            self.item_count, self.page_size, self.previous_cursor, self.next_cursor)
+
+    __repr__ = __str__
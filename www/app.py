@@ -1,17 +1,27 @@
-import logging; logging.basicConfig(level=logging.INFO)
+import logging
 import asyncio
 import datetime
-import json
+import hashlib
 import os
 import time
 
 from aiohttp import web
-from jinja2 import Environment, FileSystemLoader
-import markdown2
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 
-from coroweb import add_routes, add_static
+from config import configs
+from logs import configure as configure_logging, enabled
+configure_logging(**configs.log)
+
+from coroweb import add_routes, add_static, get_route_policy, get_cached_page, cache_page_response
 from handlers import cookie2user, COOKIE_NAME
 import orm
+import render
+from render import render_markdown
+import serializer
+import tracing
+from tracing import span
+
+_logger = logging.getLogger('web')
 
 
 def init_jinja2(app, **kw):
@@ -28,30 +38,75 @@ def init_jinja2(app, **kw):
     if path is None:
         path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
     logging.info('set jinja2 template path: %s' % path)
+    bytecode_cache = kw.get('bytecode_cache', None)
+    if bytecode_cache is True:
+        # 编译后的模板字节码缓存在磁盘上，多个 worker 进程共享；默认目录由 jinja2 检查属主和权限
+        options['bytecode_cache'] = FileSystemBytecodeCache()
+        logging.info('set jinja2 bytecode cache: %s' % options['bytecode_cache'].directory)
+    elif bytecode_cache:
+        # 字节码会被加载执行，目录必须属于当前用户且不允许其他用户访问
+        os.makedirs(bytecode_cache, mode=0o700, exist_ok=True)
+        st = os.lstat(bytecode_cache)
+        if st.st_uid != os.getuid() or st.st_mode & 0o077 or not os.path.isdir(bytecode_cache) or os.path.islink(bytecode_cache):
+            raise RuntimeError('unsafe jinja2 bytecode cache directory: %s' % bytecode_cache)
+        logging.info('set jinja2 bytecode cache: %s' % bytecode_cache)
+        options['bytecode_cache'] = FileSystemBytecodeCache(bytecode_cache)
     env = Environment(loader=FileSystemLoader(path), **options)
     filters = kw.get('filters', None)
     if filters is not None:
         for name, f in filters.items():
             env.filters[name] = f
+    if kw.get('precompile', False):
+        templates = env.list_templates(filter_func=lambda name: name.endswith('.html'))
+        for name in templates:
+            env.get_template(name)
+        logging.info('precompiled %s templates' % len(templates))
     app['__templating__'] = env
 
 
+async def trace_factory(app, handler):
+    async def trace(request):
+        t, token = tracing.start(request.method, request.path)
+        try:
+            resp = await handler(request)
+        finally:
+            timing = tracing.finish(t, token)
+        if isinstance(resp, web.StreamResponse) and not resp.prepared:
+            resp.headers['Server-Timing'] = timing
+        return resp
+    return trace
+
+
+async def db_factory(app, handler):
+    async def db(request):
+        # 读写分离的“写后读主库”只在本请求内有效，keep-alive 连接上的后续请求不受影响
+        with orm.write_scope():
+            return (await handler(request))
+    return db
+
+
 async def logger_factory(app, handler):
     async def logger(request):
-        logging.info('Request: %s %s' % (request.method, request.path))
+        if get_route_policy(request)['log'] and enabled(_logger):
+            _logger.debug('Request: %s %s', request.method, request.path)
         return (await handler(request))
     return logger
 
 
 async def auth_factory(app, handler):
     async def auth(request):
-        logging.info('check user: %s %s' % (request.method, request.path))
         request.__user__ = None
+        if not get_route_policy(request)['auth']:
+            return (await handler(request))
+        if enabled(_logger):
+            _logger.debug('check user: %s %s', request.method, request.path)
         cookie_str = request.cookies.get(COOKIE_NAME)
         if cookie_str:
-            user = await cookie2user(cookie_str)
+            with span('auth'):
+                user = await cookie2user(cookie_str)
             if user:
-                logging.info('set current user: %s' % user.email)
+                if enabled(_logger):
+                    _logger.debug('set current user: %s', user.email)
                 request.__user__ = user
         # if request.path.startswith('/manage/') and (request.__user__ is None or not request.__user__.admin):
         #     return web.HTTPFound('/signin')
@@ -59,28 +114,106 @@ async def auth_factory(app, handler):
     return auth
 
 
+def make_etag(data):
+    return '"%s"' % hashlib.sha1(data).hexdigest()
+
+
+def is_not_modified(request, etag, last_modified=None):
+    """check conditional GET headers. If-None-Match takes precedence over If-Modified-Since"""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return etag is not None and (if_none_match.strip() == '*' or etag in [t.strip() for t in if_none_match.split(',')])
+    if last_modified is not None and request.if_modified_since is not None:
+        return int(last_modified) <= request.if_modified_since.timestamp()
+    return False
+
+
+def not_modified(etag, last_modified=None):
+    resp = web.HTTPNotModified()
+    if etag is not None:
+        resp.headers['ETag'] = etag
+    if last_modified is not None:
+        resp.last_modified = last_modified
+    return resp
+
+
+def set_validators(resp, etag, last_modified=None):
+    resp.headers['ETag'] = etag
+    if last_modified is not None:
+        resp.last_modified = last_modified
+    return resp
+
+
+async def cache_factory(app, handler):
+    async def cache(request):
+        if request.method != 'GET' or request.__user__ is not None or not get_route_policy(request)['cache']:
+            return (await handler(request))
+        key = request.path_qs
+        page = get_cached_page(key)
+        if page is not None:
+            status, headers, body = page
+            if is_not_modified(request, headers.get('ETag')):
+                resp = not_modified(headers.get('ETag'))
+                for k in ('Cache-Control', 'Vary'):
+                    if k in headers:
+                        resp.headers[k] = headers[k]
+                return resp
+            return web.Response(status=status, headers=headers, body=body)
+        resp = await handler(request)
+        if type(resp) is web.Response and resp.status == 200 and resp.body is not None:
+            cache_page_response(key, resp)
+        return resp
+    return cache
+
+
 async def data_factory(app, handler):
     async def parse_data(request):
         if request.method == 'POST':
             ct = request.content_type.lower()
             if ct.startswith('application/json'):
                 request.__data__ = await request.json()
-                logging.info('request json: %s' % request.__data__)
+                _logger.debug('request json: %s', request.__data__)
             elif ct.startswith('application/x-www-form-urlencoded'):
                 request.__data__ = await request.post()
-                logging.info('request form: %s' % request.__data__)
+                _logger.debug('request form: %s', request.__data__)
         return (await handler(request))
     return parse_data
 
 
+async def stream_json(request, items, chunk_size=65536):
+    """stream items of an async iterator as a chunked JSON array"""
+    resp = web.StreamResponse()
+    resp.content_type = 'application/json'
+    resp.enable_chunked_encoding()
+    await resp.prepare(request)
+    buf, size, sep = [b'['], 1, b''
+    async for item in items:
+        data = sep + serializer.dumps(item)
+        buf.append(data)
+        size += len(data)
+        sep = b','
+        if size >= chunk_size:
+            await resp.write(b''.join(buf))
+            buf, size = [], 0
+    buf.append(b']')
+    await resp.write(b''.join(buf))
+    await resp.write_eof()
+    return resp
+
+
 async def response_factory(app, handler):
     async def response(request):
-        logging.info('Response handler...')
+        if enabled(_logger):
+            _logger.debug('Response handler...')
         r = await handler(request)
         if isinstance(r, web.StreamResponse):
             return r
         if isinstance(r, bytes):
             return web.Response(body=r, content_type='application/octet-stream')
+        if hasattr(r, '__aiter__'):
+            return (await stream_json(request, r))
         if isinstance(r, str):
             if r.startswith('redirect:'):
                 return web.HTTPFound(r[9:])
@@ -89,15 +222,32 @@ async def response_factory(app, handler):
             return resp
         if isinstance(r, dict):
             template = r.get('__template__')
+            last_modified = r.pop('__last_modified__', None)
             if template is None:
-                s = json.dumps(r, ensure_ascii=False, default=lambda o: o.__dict__)
-                return web.Response(body=s.encode('utf8'), content_type='application/json')
+                with span('json'):
+                    body = serializer.dumps(r)
+                etag = make_etag(body)
+                if is_not_modified(request, etag, last_modified):
+                    return not_modified(etag, last_modified)
+                resp = web.Response(body=body, content_type='application/json')
+                return set_validators(resp, etag, last_modified)
             else:
                 if 'user' not in r:
                     r['user'] = request.__user__
-                s = app['__templating__'].get_template(template).render(**r)
-                resp = web.Response(body=s.encode('utf8'))
-                resp.content_type = 'text/html;charset=utf-8'
+                # 页面还取决于模板源码、当前用户和相对时间（datetime 过滤器），只能由渲染结果计算 ETag，
+                # 不使用 Last-Modified；浏览器每次都需用 If-None-Match 验证
+                with span('render'):
+                    s = await render.render_template(app['__templating__'], template, r)
+                body = s.encode('utf8')
+                etag = make_etag(body)
+                if is_not_modified(request, etag):
+                    resp = not_modified(etag)
+                else:
+                    resp = web.Response(body=body)
+                    resp.content_type = 'text/html;charset=utf-8'
+                    set_validators(resp, etag)
+                resp.headers['Cache-Control'] = 'no-cache'
+                resp.headers['Vary'] = 'Cookie'
                 return resp
         if isinstance(r, int) and r >= 100 and r < 600:
             return web.Response(r)
@@ -122,12 +272,12 @@ def datetime_filter(t):
         return '%s小时前' % (delta // 3600)
     if delta < 3600 * 24 * 7:
         return '%s天前' % (delta // (3600 * 24))
-    dt = datetime.fromtimestamp(t)
+    dt = datetime.datetime.fromtimestamp(t)
     return '%4s-%02s-%02s' % (dt.year, dt.month, dt.day)
 
 
-def markdown_filter(mtext):
-    return markdown2.markdown(mtext)
+def markdown_filter(mtext, key=None):
+    return render_markdown(mtext, key)
 
 
 def text2html_filter(text):
@@ -135,16 +285,28 @@ def text2html_filter(text):
     return ''.join(lines)
 
 
+def templating_options():
+    """templating config, auto_reload and bytecode_cache follow debug when not set"""
+    options = dict(configs.templating)
+    if options.get('auto_reload') is None:
+        options['auto_reload'] = configs.debug
+    if options.get('bytecode_cache') is None:
+        options['bytecode_cache'] = not configs.debug
+    return options
+
+
 def init_app():
     loop = asyncio.get_event_loop()
-    db_task = orm.create_pool(loop=loop, user='www-data', password='www-data', db='awesome')
+    tracing.set_slowest_size(configs.trace.slowest)
+    db_task = orm.create_pool(loop=loop, **configs.db)
     loop.run_until_complete(db_task)
     app = web.Application(loop=loop, middlewares=[
-        logger_factory, auth_factory, response_factory
+        trace_factory, db_factory, logger_factory, auth_factory, cache_factory, response_factory
     ])
     init_jinja2(app, filters=dict(
         datetime=datetime_filter, markdown=markdown_filter, text2html=text2html_filter
-    ))
+    ), **templating_options())
+    render.init_executors(**configs.render)
     add_routes(app, 'handlers')
     add_static(app)
     return app
@@ -153,4 +315,4 @@ def init_app():
 
 if __name__ == '__main__':
     app = init_app()
-    web.run_app(app, host='127.0.0.1', port=8000)
+    web.run_app(app, host=configs.server.host, port=configs.server.port)
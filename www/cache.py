@@ -0,0 +1,97 @@
+import collections
+import logging
+import time
+
+
+class LRUCache(object):
+    """In-process LRU cache bounded by entry count and, optionally, by total weight"""
+    def __init__(self, maxsize=128, maxweight=None, weigh=None):
+        self.maxsize = maxsize
+        self.maxweight = maxweight
+        self._weigh = weigh or (lambda value: 1)
+        self._data = collections.OrderedDict()
+        self._weight = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def keys(self):
+        return list(self._data.keys())
+
+    @property
+    def weight(self):
+        return self._weight
+
+    def get(self, key, default=None):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.pop(key)
+        weight = self._weigh(value)
+        if self.maxweight is not None and weight > self.maxweight:
+            logging.debug('value too large for cache: %s (weight %s)' % (key, weight))
+            return
+        self._data[key] = value
+        self._weight += weight
+        while len(self._data) > self.maxsize or (self.maxweight is not None and self._weight > self.maxweight):
+            _, evicted = self._data.popitem(last=False)
+            self._weight -= self._weigh(evicted)
+
+    def pop(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return default
+        self._weight -= self._weigh(value)
+        return value
+
+    def clear(self):
+        self._data.clear()
+        self._weight = 0
+
+
+class TTLCache(LRUCache):
+    """LRU cache whose entries expire at a given unix timestamp"""
+    def __init__(self, maxsize=128, ttl=60, maxweight=None, weigh=None):
+        super().__init__(maxsize, maxweight, weigh and (lambda entry: weigh(entry[1])))
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.time():
+            self.pop(key)
+            return default
+        return value
+
+    def put(self, key, value, expires=None):
+        """cache value until expires, but never longer than ttl seconds from now"""
+        deadline = time.time() + self.ttl
+        if expires is None or expires > deadline:
+            expires = deadline
+        super().put(key, (expires, value))
+
+    def pop(self, key, default=None):
+        entry = super().pop(key)
+        return default if entry is None else entry[1]
+
+    def pop_if(self, predicate):
+        """drop every entry whose value matches predicate"""
+        keys = [k for k, (_, v) in self._data.items() if predicate(v)]
+        for k in keys:
+            self.pop(k)
+        return len(keys)
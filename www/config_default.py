@@ -1,13 +1,67 @@
 configs = {
     'debug': True,
+    'server': {
+        'host': '127.0.0.1',
+        'port': 8000,
+        # launcher.py 启动的 worker 进程数，0 表示 CPU 核数
+        'workers': 0
+    },
+    'log': {
+        'level': 'INFO',
+        # orm: 每条 SQL，web: 每个请求的中间件和参数日志，均为 DEBUG 级别
+        'levels': {
+            'orm': 'INFO',
+            'web': 'INFO'
+        },
+        'sample_rate': 1.0
+    },
     'db': {
         'host': '127.0.0.1',
         'port': 3306,
-        'user': 'www',
-        'password': 'www',
-        'db': 'awesome'
+        'user': 'www-data',
+        'password': 'www-data',
+        'db': 'awesome',
+        # 只读副本，未指定的连接参数与主库相同；read_balance: round_robin 或 least_busy
+        'replicas': [],
+        'read_balance': 'round_robin'
     },
     'session': {
-        'secret': 'Awesome'
+        'secret': 'Awesome',
+        'cache_size': 10000,
+        'cache_ttl': 300
+    },
+    'json': {
+        # auto 会优先使用已安装的 orjson 或 ujson
+        'backend': 'auto'
+    },
+    'templating': {
+        # None 表示随 debug：debug 为 False（生产环境）时关闭 auto_reload 并启用字节码缓存。
+        # bytecode_cache 为 True 时使用 jinja2 默认的按用户区分的私有目录，也可指定本应用专属的目录
+        'auto_reload': None,
+        'bytecode_cache': None,
+        'precompile': True
+    },
+    'render': {
+        # markdown 渲染用 thread 或 process 池，模板总是用线程池；max_pending 为同时渲染数的上限
+        'executor': 'thread',
+        'workers': 4,
+        'max_pending': 64
+    },
+    'trace': {
+        # 保留最慢的请求数
+        'slowest': 50
+    },
+    'cache': {
+        'page': {
+            # 页面和会话缓存都在各 worker 进程内。launcher 启动的 worker 之间，evict_pages 通过共享的代数计数
+            # 让其他 worker 清空页面缓存；invalidate_user_session 只清除当前进程，其他 worker 最多 session.cache_ttl 秒后生效
+            'maxsize': 1024,
+            'maxbytes': 64 * 1024 * 1024,
+            'ttl': 60
+        },
+        'markdown': {
+            'maxsize': 1024,
+            'maxbytes': 64 * 1024 * 1024
+        }
     }
 }
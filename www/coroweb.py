@@ -4,11 +4,16 @@ import functools
 import importlib
 import inspect
 import os
-from urllib import parse
 
 from aiohttp import web
 
 from apis import APIError, APIPermissionError
+from cache import TTLCache
+from config import configs
+from logs import enabled
+from tracing import span
+
+_logger = logging.getLogger('web')
 
 
 def get(path):
@@ -35,10 +40,92 @@ def post(path):
     return decorator
 
 
+def anonymous(func):
+    """define @anonymous decorator: the route needs no user resolution"""
+    func.__anonymous__ = True
+    return func
+
+
+def cache_page(func):
+    """define @cache_page decorator: rendered response for anonymous GET is cached"""
+    func.__cache_page__ = True
+    return func
+
+
+# 路由级中间件策略：auth 是否解析当前用户，log 是否记录请求日志，cache 是否缓存匿名用户的页面
+DEFAULT_POLICY = dict(auth=True, log=True, cache=False)
+ANONYMOUS_POLICY = dict(auth=False, log=True, cache=False)
+STATIC_POLICY = dict(auth=False, log=False, cache=False)
+
+# 匿名用户的整页缓存：path?query => (status, headers, body)
+_page_cache = TTLCache(
+    maxsize=configs.cache.page.maxsize,
+    ttl=configs.cache.page.ttl,
+    maxweight=configs.cache.page.maxbytes,
+    weigh=lambda page: len(page[2])
+)
+
+# 多 worker 共享的页面缓存代数，由 launcher 在 fork 前创建；任一 worker 清除页面后加一，
+# 其他 worker 发现代数变化即清空本地页面缓存
+_page_generation = None
+_seen_generation = 0
+
+
+def share_page_generation(value):
+    """use a multiprocessing.Value shared by all workers to propagate evict_pages"""
+    global _page_generation, _seen_generation
+    _page_generation = value
+    _seen_generation = value.value
+
+
+def _sync_page_generation(bump=False):
+    global _seen_generation
+    if _page_generation is None:
+        return
+    with _page_generation.get_lock():
+        if _page_generation.value != _seen_generation:
+            _page_cache.clear()
+        if bump:
+            _page_generation.value += 1
+        _seen_generation = _page_generation.value
+
+
+def get_cached_page(key):
+    _sync_page_generation()
+    return _page_cache.get(key)
+
+
+def cache_page_response(key, resp):
+    headers = {k: resp.headers[k] for k in ('Content-Type', 'ETag', 'Last-Modified', 'Cache-Control', 'Vary') if k in resp.headers}
+    _page_cache.put(key, (resp.status, headers, resp.body))
+
+
+def evict_pages(prefix=''):
+    """evict cached pages whose path starts with prefix, or all pages by default"""
+    _sync_page_generation(bump=True)
+    if not prefix:
+        _page_cache.clear()
+        return
+    for key in [k for k in _page_cache.keys() if k.startswith(prefix)]:
+        _page_cache.pop(key)
+
+
+def set_route_policy(app, route, policy):
+    if '__policies__' not in app:
+        app['__policies__'] = dict()
+    app['__policies__'][route] = policy
+
+
+def get_route_policy(request):
+    """get middleware policy of the route matched by request"""
+    policies = request.app.get('__policies__')
+    if not policies:
+        return DEFAULT_POLICY
+    return policies.get(request.match_info.route, DEFAULT_POLICY)
+
+
 def require_signin(func):
     flag = has_request_arg(func)
-    if not flag:
-        insert_request_arg(func)
     @functools.wraps(func)
     def wrapper(*args, **kw):
         request = kw['request']
@@ -49,14 +136,15 @@ def require_signin(func):
         if not flag:
             kw.pop('request')
         return func(*args, **kw)
+    # 只修改 wrapper 的签名，不影响被装饰的函数
+    if not flag:
+        insert_request_arg(wrapper)
     return wrapper
 
 
 def require_admin(func):
     # assert has_request_arg(func), 'Handler "%s" decorated by "require_admin" must has an argument "request"' % func.__name__
     flag = has_request_arg(func)
-    if not flag:
-        insert_request_arg(func)
     @functools.wraps(func)
     def wrapper(*args, **kw):
         request = kw['request']
@@ -67,6 +155,9 @@ def require_admin(func):
         if not flag:
             kw.pop('request')
         return func(*args, **kw)
+    # 只修改 wrapper 的签名，不影响被装饰的函数
+    if not flag:
+        insert_request_arg(wrapper)
     return wrapper
 
 
@@ -132,6 +223,21 @@ def insert_request_arg(fn):
     fn.__signature__ = new_sig
 
 
+async def parse_body(request):
+    """parse POST body by content type, return (params, None) or (None, error response)"""
+    if not request.content_type:
+        return None, web.HTTPBadRequest(reason='Missing Content-Type.')
+    ct = request.content_type.lower()
+    if ct.startswith('application/json'):
+        params = await request.json()
+        if not isinstance(params, dict):
+            return None, web.HTTPBadRequest(reason='JSON body must be object.')
+        return params, None
+    if ct.startswith('application/x-www-form-urlencoded') or ct.startswith('multipart/form-data'):
+        return dict(**(await request.post())), None
+    return None, web.HTTPBadRequest(reason='Unsupported Content-Type: %s' % request.content_type)
+
+
 class RequestHandler(object):
     def __init__(self, app, fn):
         self._app = app
@@ -141,57 +247,62 @@ class RequestHandler(object):
         self._has_named_kw_args = has_named_kw_args(fn)
         self._named_kw_args = get_named_kw_args(fn)
         self._required_kw_args = get_required_kw_args(fn)
-
-    async def __call__(self, request):
-        kw = None
-        if self._has_named_kw_args or self._has_var_kw_arg:
+        self._bind = self._compile_binder()
+
+    def _compile_binder(self):
+        """build the argument binder of handler once at registration, it returns (kw, None) or
+        (None, error response) and does only the work the signature of handler needs"""
+        has_request_arg = self._has_request_arg
+        required_kw_args = self._required_kw_args
+        if not self._has_named_kw_args and not self._has_var_kw_arg:
+            async def bind(request):
+                kw = dict(request.match_info)
+                if has_request_arg:
+                    kw['request'] = request
+                return kw, None
+            return bind
+
+        # 没有 **kw 参数时只取命名关键字参数
+        names = None if self._has_var_kw_arg else self._named_kw_args
+
+        async def bind(request):
             if request.method == 'POST':
-                if not request.content_type:
-                    return web.HTTPBadRequest(reason='Missing Content-Type.')
-                ct = request.content_type.lower()
-                if ct.startswith('application/json'):
-                    params = await request.json()
-                    if not isinstance(params, dict):
-                        return web.HTTPBadRequest(reason='JSON body must be object.')
-                    kw = params
-                elif ct.startswith('application/x-www-form-urlencoded') or ct.startswith('multipart/form-data'):
-                    params = await request.post()
-                    kw = dict(**params)
-                else:
-                    return web.HTTPBadRequest(reason='Unsupported Content-Type: %s' % request.content_type)
-            if request.method == 'GET':
-                qs = request.query_string
-                if qs:
-                    kw = dict()
-                    params = parse.parse_qs(qs, keep_blank_values=True)
-                    for k, v in params.items():
-                        kw[k] = v[0] if len(v) == 1 else v
-
-        if kw is None:
-            kw = dict(**request.match_info)
-        else:
-            if not self._has_var_kw_arg and self._named_kw_args:
-                # remove all unnamed kw args
-                copy = dict()
-                for name in self._named_kw_args:
-                    if name in kw:
-                        copy[name] = kw[name]
-                kw = copy
-            # check named args
-            for k, v in request.match_info.items():
-                if k in kw:
-                    logging.warn('Duplicate arg name in named arg and kw args: %s' % k)
-                kw[k] = v
-        if self._has_request_arg:
-            kw['request'] = request
-        # check required kw
-        if self._required_kw_args:
-            for name in self._required_kw_args:
+                params, error = await parse_body(request)
+                if error is not None:
+                    return None, error
+            elif request.method == 'GET':
+                params = request.query
+            else:
+                params = None
+            if not params:
+                kw = dict(request.match_info)
+            else:
+                kw = dict()
+                for name in (names or params.keys()):
+                    if name in params:
+                        values = params.getall(name) if hasattr(params, 'getall') else (params[name],)
+                        kw[name] = values[0] if len(values) == 1 else values
+                for k, v in request.match_info.items():
+                    if k in kw:
+                        logging.warn('Duplicate arg name in named arg and kw args: %s' % k)
+                    kw[k] = v
+            if has_request_arg:
+                kw['request'] = request
+            for name in required_kw_args:
                 if name not in kw:
-                    return web.HTTPBadRequest(reason='Missing argument: %s' % name)
-        logging.info('call with args: %s' % kw)
+                    return None, web.HTTPBadRequest(reason='Missing argument: %s' % name)
+            return kw, None
+        return bind
+
+    async def __call__(self, request):
+        kw, error = await self._bind(request)
+        if error is not None:
+            return error
+        if enabled(_logger):
+            _logger.debug('call with args: %s', kw)
         try:
-            r = await self._func(**kw)
+            with span('handler'):
+                r = await self._func(**kw)
             return r
         except APIPermissionError:
             return web.HTTPFound('/permission_denied')
@@ -199,13 +310,15 @@ class RequestHandler(object):
             return dict(error=e.error, data=e.data, message=e.message)
 
 
-def add_static(app):
+def add_static(app, policy=STATIC_POLICY):
     path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
-    app.router.add_static('/static/', path)
+    resource = app.router.add_static('/static/', path)
+    for route in resource:
+        set_route_policy(app, route, policy)
     logging.info('add static %s => %s' % ('/static/', path))
 
 
-def add_route(app, fn):
+def add_route(app, fn, policy=None):
     method = getattr(fn, '__method__', None)
     path = getattr(fn, '__route__', None)
     if method is None or path is None:
@@ -213,7 +326,12 @@ def add_route(app, fn):
     if not asyncio.iscoroutinefunction(fn) or inspect.isgeneratorfunction(fn):
         fn = asyncio.coroutine(fn)
     logging.info('add route %s %s => %s%s' % (method, path, fn.__name__, inspect.signature(fn)))
-    app.router.add_route(method, path, RequestHandler(app, fn))
+    if policy is None:
+        policy = ANONYMOUS_POLICY if getattr(fn, '__anonymous__', False) else DEFAULT_POLICY
+        if getattr(fn, '__cache_page__', False):
+            policy = dict(policy, cache=True)
+    route = app.router.add_route(method, path, RequestHandler(app, fn))
+    set_route_policy(app, route, policy)
 
 
 def add_routes(app, module_name):
@@ -1,22 +1,35 @@
 import logging
 import functools
 import hashlib
-import json
 import re
 import time
 
 from aiohttp import web
 
-from apis import APIError, APIValueError, APIPermissionError, APIResourceNotFoundError, Page
+from apis import APIError, APIValueError, APIPermissionError, APIResourceNotFoundError, Page, CursorPage, decode_cursor
+from cache import TTLCache
 from config import configs
-from coroweb import get, post, require_admin, require_signin
+from coroweb import anonymous, cache_page, evict_pages, get, post, require_admin, require_signin
 from models import User, Blog, Comment, next_id
+from metrics import snapshot as metrics_snapshot
+from orm import gather, pool_stats
+import profiler
+import serializer
+import tracing
+from render import render_markdown_async, invalidate_markdown
 
 
 COOKIE_NAME = 'awesession'
 COOKIE_MAX_AGE = 86400
+COMMENT_PAGE_SIZE = 20
+# 列表页只取需要的字段，不读取 mediumtext 的正文和用户的密码
+BLOG_LIST_FIELDS = ('user_id', 'user_name', 'user_image', 'name', 'summary', 'created_at')
+USER_LIST_FIELDS = ('email', 'admin', 'name', 'image', 'created_at')
 _COOKIE_KEY = configs.session.secret
 
+# 已验证的 session：cookie => user，有效期不超过 cookie 本身的 expires
+_session_cache = TTLCache(maxsize=configs.session.cache_size, ttl=configs.session.cache_ttl)
+
 
 def get_page_index(page_str):
     p = 1
@@ -29,6 +42,18 @@ def get_page_index(page_str):
     return p
 
 
+async def get_cursor_page(model, after=None, before=None, page_size=10, with_count=False, where=None, args=None, fields=None):
+    """find a page of model by cursor, return (CursorPage, items)"""
+    after, before = after or None, before or None
+    if after and before:
+        raise APIValueError('before', 'after and before cannot be both specified.')
+    cursor = after or before
+    seek = decode_cursor(cursor) if cursor else None
+    items = await model.find_rows(where, args, seek=seek, ascending=before is not None, limit=page_size + 1, fields=fields)
+    item_count = (await model.find_number('count(id)')) if with_count else None
+    return CursorPage(items, page_size, after, before, item_count), items
+
+
 def user2cookie(user, max_age):
     """generate cookie string by user"""
     # build cookie string by 'id-expires-sha1(id-password-expires-secret)'
@@ -38,9 +63,18 @@ def user2cookie(user, max_age):
     return '-'.join(lst)
 
 
+def invalidate_user_session(uid):
+    """drop cached sessions of user. must be called when password or admin flag of user changed"""
+    n = _session_cache.pop_if(lambda user: user.id == uid)
+    logging.info('invalidate %s cached session(s) of user %s' % (n, uid))
+
+
 async def cookie2user(cookie_str):
     if not cookie_str:
         return None
+    user = _session_cache.get(cookie_str)
+    if user is not None:
+        return user
     try:
         lst = cookie_str.split('-')
         if len(lst) != 3:
@@ -56,21 +90,17 @@ async def cookie2user(cookie_str):
             logging.info('Invalid sha1')
             return None
         user.password = '******'
+        _session_cache.put(cookie_str, user, int(expires))
         return user
     except Exception as e:
         logging.exception(e)
         return None
 
 
+@cache_page
 @get('/')
-async def index(*, page='1'):
-    page_index = get_page_index(page)
-    nblogs = await Blog.find_number('count(id)')
-    page = Page(nblogs, page_index)
-    if nblogs == 0:
-        blogs = []
-    else:
-        blogs = await Blog.find_all(order_by='created_at desc', limit=(page.offset, page.limit))
+async def index(*, after=None, before=None):
+    page, blogs = await get_cursor_page(Blog, after, before, fields=BLOG_LIST_FIELDS)
     return {
         '__template__': 'blogs.html',
         'page': page,
@@ -78,14 +108,21 @@ async def index(*, page='1'):
     }
 
 
+@cache_page
 @get('/blog/{id_}')
 async def get_blog(request, *, id_):
-    blog = await Blog.find(id_)
-    comments = await Comment.find_all('blog_id=?', (id_,), order_by='created_at desc')
+    blog, (comment_page, comments) = await gather(
+        Blog.find(id_),
+        get_cursor_page(Comment, page_size=COMMENT_PAGE_SIZE, where='blog_id=?', args=(id_,))
+    )
+    if blog is not None:
+        # 预先在 executor 中渲染正文，模板中的 markdown 过滤器直接命中缓存
+        await render_markdown_async(blog.content, blog.id)
     return {
         '__template__': 'blog.html',
         'blog': blog,
         'comments': comments,
+        'comment_page': comment_page,
     }
 
 
@@ -94,15 +131,18 @@ def register():
     return {'__template__': 'register.html'}
 
 
+@anonymous
 @get('/signin')
 def signin():
     return {'__template__': 'signin.html'}
 
 
+@anonymous
 @get('/signout')
 def signout(request):
     referer = request.headers.get('Referer')
     r = web.HTTPFound(referer or '/')
+    _session_cache.pop(request.cookies.get(COOKIE_NAME))
     r.set_cookie(COOKIE_NAME, '-deleted-', max_age=0, httponly=True)
     logging.info('user signed out.')
     return r
@@ -160,6 +200,7 @@ def manage_comments(*, page='1'):
     }
 
 
+@anonymous
 @post('/api/authenticate')
 async def api_authenticate(*, email, password):
     if not email:
@@ -179,7 +220,7 @@ async def api_authenticate(*, email, password):
     r.set_cookie(COOKIE_NAME, user2cookie(user, COOKIE_MAX_AGE), max_age=COOKIE_MAX_AGE, httponly=True)
     r.content_type = 'application/json'
     user.password = '******'
-    r.body = json.dumps(user, ensure_ascii=False).encode('utf8')
+    r.body = serializer.dumps(user)
     return r
 
 
@@ -187,6 +228,7 @@ _RE_EMAIL = re.compile(r'^[a-z0-9\.\-\_]+\@[a-z0-9\-\_]+(\.[a-z0-9\-\_]+){1,4}$'
 _RE_SHA1 = re.compile(r'^[0-9a-f]{40}$')
 
 
+@anonymous
 @post('/api/users')
 async def api_register_user(*, email, name, password):
     if not name or not name.strip():
@@ -208,21 +250,26 @@ async def api_register_user(*, email, name, password):
     r.set_cookie(COOKIE_NAME, user2cookie(user, COOKIE_MAX_AGE), max_age=COOKIE_MAX_AGE, httponly=True)
     r.content_type = 'application/json'
     user.password = '******'
-    r.body = json.dumps(user, ensure_ascii=False).encode('utf8')
+    r.body = serializer.dumps(user)
     return r
 
 
+@anonymous
 @get('/api/blogs')
-async def api_get_blogs(*, page='1'):
+async def api_get_blogs(*, page='1', after=None, before=None):
+    if after or before:
+        p, blogs = await get_cursor_page(Blog, after, before, with_count=True, fields=BLOG_LIST_FIELDS)
+        return dict(page=p, blogs=blogs)
     page_index = get_page_index(page)
     nblogs = await Blog.find_number('count(id)')
     p = Page(nblogs, page_index)
     if nblogs == 0:
         return dict(page=p, blogs=())
-    blogs = await Blog.find_all(order_by='created_at desc', limit=(p.offset, p.limit))
+    blogs = await Blog.find_rows(order_by='created_at desc', limit=(p.offset, p.limit), fields=BLOG_LIST_FIELDS)
     return dict(page=p, blogs=blogs)
 
 
+@anonymous
 @get('/api/blogs/{id_}')
 async def api_get_blog(*, id_):
     blog = await Blog.find(id_)
@@ -243,6 +290,8 @@ async def api_create_blog(request, *, name, summary, content):
     user = request.__user__
     blog = Blog(user_id=user.id, user_name=user.name, user_image=user.image, name=name.strip(), summary=summary.strip(), content=content.strip())
     await blog.save()
+    await render_markdown_async(blog.content, blog.id)
+    evict_pages()
     return blog
 
 
@@ -261,7 +310,10 @@ async def api_update_blog(blog_id, *, name, summary, content):
     blog.name = name.strip()
     blog.summary = summary.strip()
     blog.content = content.strip()
+    blog.updated_at = time.time()
     await blog.update()
+    await render_markdown_async(blog.content, blog.id)
+    evict_pages()
     return blog
 
 
@@ -272,17 +324,29 @@ async def api_delete_blog(blog_id):
     if blog is None:
         raise APIResourceNotFoundError('Blog')
     await blog.remove()
+    invalidate_markdown(blog_id)
+    evict_pages()
     return dict(id=blog_id)
 
 
 @get('/api/comments')
-async def api_get_comments(*, page='1'):
+async def api_get_comments(*, page='1', after=None, before=None):
+    if after or before:
+        p, comments = await get_cursor_page(Comment, after, before, with_count=True)
+        return dict(page=p, comments=comments)
     page_index = get_page_index(page)
     ncomments = await Comment.find_number('count(id)')
     p = Page(ncomments, page_index)
     if ncomments == 0:
         return dict(page=p, comments=())
-    comments = await Comment.find_all(order_by='created_at desc', limit=(p.offset, p.limit))
+    comments = await Comment.find_rows(order_by='created_at desc', limit=(p.offset, p.limit))
+    return dict(page=p, comments=comments)
+
+
+@anonymous
+@get('/api/blogs/{blog_id}/comments')
+async def api_get_blog_comments(blog_id, *, after=None, before=None):
+    p, comments = await get_cursor_page(Comment, after, before, COMMENT_PAGE_SIZE, where='blog_id=?', args=(blog_id,))
     return dict(page=p, comments=comments)
 
 
@@ -294,6 +358,7 @@ async def api_create_comment(blog_id, request, *, content):
     user = request.__user__
     comment = Comment(blog_id=blog_id, user_id=user.id, user_name=user.name, user_image=user.image, content=content.strip())
     await comment.save()
+    evict_pages('/blog/%s' % blog_id)
     return comment
 
 
@@ -304,16 +369,59 @@ async def api_delete_comment(comment_id):
     if comment is None:
         raise APIResourceNotFoundError('Comment')
     await comment.remove()
+    evict_pages('/blog/%s' % comment.blog_id)
     return dict(id=comment_id)
 
 
 @require_admin
 @get('/api/users')
-async def api_get_users(*, page='1'):
+async def api_get_users(*, page='1', after=None, before=None):
+    if after or before:
+        p, users = await get_cursor_page(User, after, before, with_count=True, fields=USER_LIST_FIELDS)
+        return dict(page=p, users=users)
     page_index = get_page_index(page)
     nusers = await User.find_number('count(id)')
+    p = Page(nusers, page_index)
     if nusers == 0:
         return dict(page=p, users=())
-    p = Page(nusers, page_index)
-    users = await User.find_all(order_by='created_at desc', limit=(p.offset, p.limit))
+    users = await User.find_rows(order_by='created_at desc', limit=(p.offset, p.limit), fields=USER_LIST_FIELDS)
     return dict(page=p, users=users)
+
+
+@require_admin
+@get('/api/users/export')
+async def api_export_users():
+    async for user in User.iter_all(order_by='created_at desc'):
+        user.password = '******'
+        yield user
+
+
+@require_admin
+@get('/api/comments/export')
+def api_export_comments():
+    return Comment.iter_all(order_by='created_at desc')
+
+
+@require_admin
+@get('/api/metrics')
+def api_get_metrics():
+    return dict(metrics_snapshot(), pools=pool_stats())
+
+
+@require_admin
+@get('/api/traces')
+def api_get_traces():
+    return dict(traces=tracing.slowest())
+
+
+@require_admin
+@get('/api/profile')
+async def api_profile(*, seconds='5'):
+    try:
+        seconds = min(max(float(seconds), 0.1), 60)
+    except ValueError:
+        raise APIValueError('seconds', 'seconds must be a number.')
+    try:
+        return (await profiler.profile(seconds))
+    except RuntimeError as e:
+        raise APIError('profile:busy', 'profile', str(e))
@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+
+def log(s):
+    print('[Launcher] %s' % s)
+
+
+def run_worker(host, port, ready, page_generation):
+    # 在子进程中才导入 app：每个 worker 有自己的事件循环和数据库连接池，滚动重启时也会加载新代码
+    for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, signal.SIG_DFL)
+    import asyncio
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    from aiohttp import web
+    import app
+    import coroweb
+    coroweb.share_page_generation(page_generation)
+    application = app.init_app()
+    runner = web.AppRunner(application)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, host, port, reuse_port=True)
+    loop.run_until_complete(site.start())
+    # 端口已绑定并开始 accept 后才通知 supervisor，滚动重启时旧 worker 才会被停止
+    ready.set()
+    # SIGTERM 时停止 accept，并等待处理中的请求完成后再退出
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    try:
+        loop.run_forever()
+    finally:
+        loop.run_until_complete(runner.cleanup())
+        loop.close()
+
+
+class Supervisor(object):
+    """Fork N workers sharing the listening port via SO_REUSEPORT, respawn dead ones and
+    restart them one by one on SIGHUP"""
+    def __init__(self, host, port, workers, ready_timeout=30):
+        self.host = host
+        self.port = port
+        self.nworkers = workers
+        self.ready_timeout = ready_timeout
+        self.workers = []
+        self.restarting = False
+        self.stopping = False
+        # 各 worker 共享的页面缓存代数，用于在 worker 之间传播 evict_pages
+        self.page_generation = multiprocessing.Value('L', 0)
+
+    def spawn(self):
+        ready = multiprocessing.Event()
+        p = multiprocessing.Process(target=run_worker, args=(self.host, self.port, ready, self.page_generation), daemon=False)
+        p.start()
+        log('Start worker [%s]...' % p.pid)
+        return p, ready
+
+    def stop_worker(self, p):
+        log('Stop worker [%s]...' % p.pid)
+        p.terminate()
+        p.join()
+        log('Worker [%s] ended with code %s.' % (p.pid, p.exitcode))
+
+    def rolling_restart(self):
+        """replace workers one by one, the old one is stopped only after the new one is ready"""
+        log('Rolling restart %s workers...' % len(self.workers))
+        for i, old in enumerate(list(self.workers)):
+            p, ready = self.spawn()
+            if not ready.wait(self.ready_timeout):
+                log('Worker [%s] not ready in %s seconds, abort rolling restart.' % (p.pid, self.ready_timeout))
+                self.stop_worker(p)
+                return
+            self.workers[i] = p
+            self.stop_worker(old)
+        log('Rolling restart done.')
+
+    def on_hup(self, signum, frame):
+        self.restarting = True
+
+    def on_term(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self.on_hup)
+        signal.signal(signal.SIGTERM, self.on_term)
+        signal.signal(signal.SIGINT, self.on_term)
+        log('Serving on %s:%s with %s workers, pid %s (SIGHUP to restart workers).' % (self.host, self.port, self.nworkers, os.getpid()))
+        self.workers = [self.spawn()[0] for i in range(self.nworkers)]
+        while not self.stopping:
+            if self.restarting:
+                self.restarting = False
+                self.rolling_restart()
+            for i, p in enumerate(self.workers):
+                if not p.is_alive():
+                    log('Worker [%s] died with code %s, respawn.' % (p.pid, p.exitcode))
+                    self.workers[i] = self.spawn()[0]
+            time.sleep(0.5)
+        for p in self.workers:
+            self.stop_worker(p)
+
+
+if __name__ == '__main__':
+    # 读取配置前不导入 app，保证 worker 进程中重新加载代码
+    from config import configs
+    multiprocessing.set_start_method('fork')
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else (configs.server.workers or os.cpu_count())
+    Supervisor(configs.server.host, configs.server.port, workers).run()
@@ -0,0 +1,35 @@
+import logging
+import random
+
+
+# 每请求/每条 SQL 的日志按比例采样，只有级别开启且被采中时才会格式化
+_sample_rate = 1.0
+
+
+def configure(level='INFO', levels=None, sample_rate=1.0):
+    """configure root logging level, per-logger levels and the sample rate of hot path logs"""
+    global _sample_rate
+    logging.basicConfig(level=level)
+    logging.getLogger().setLevel(level)
+    for name, lv in (levels or {}).items():
+        logging.getLogger(name).setLevel(lv)
+    _sample_rate = sample_rate
+
+
+def enabled(logger, level=logging.DEBUG):
+    """check if a hot path log record of level should be emitted"""
+    if not logger.isEnabledFor(level):
+        return False
+    return _sample_rate >= 1.0 or random.random() < _sample_rate
+
+
+class SQLMessage(object):
+    """sql with args, formatted only when the record is actually emitted"""
+    __slots__ = ('sql', 'args')
+
+    def __init__(self, sql, args):
+        self.sql = sql
+        self.args = args
+
+    def __str__(self):
+        return self.sql.replace('?', '%r') % tuple(self.args or ())
@@ -0,0 +1,70 @@
+import bisect
+import time
+
+
+# 直方图的桶上界，单位与观测值相同（毫秒或行数）
+DEFAULT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram(object):
+    """Fixed bucket histogram with count, sum, max and approximate percentiles"""
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """upper bound of the bucket holding the p-th percentile"""
+        if self.count == 0:
+            return None
+        rank = self.count * p / 100.0
+        n = 0
+        for i, c in enumerate(self.counts):
+            n += c
+            if n >= rank:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self):
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            avg=self.sum / self.count if self.count else None,
+            max=self.max,
+            p50=self.percentile(50),
+            p95=self.percentile(95),
+            p99=self.percentile(99),
+            buckets=dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts))
+        )
+
+
+_histograms = dict()
+_started_at = time.time()
+
+
+def observe(name, value):
+    h = _histograms.get(name)
+    if h is None:
+        h = _histograms[name] = Histogram()
+    h.observe(value)
+
+
+def snapshot():
+    """snapshot of all histograms"""
+    return dict(
+        uptime=time.time() - _started_at,
+        histograms={name: h.snapshot() for name, h in sorted(_histograms.items())}
+    )
+
+
+def reset():
+    _histograms.clear()
@@ -1,18 +1,68 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import itertools
 import logging
+import time
 
 import aiomysql
 
+from logs import SQLMessage, enabled
+from metrics import observe
+from tracing import span
+
+_logger = logging.getLogger('orm')
+
 
 def log(sql, args=None):
-    if not args:
-        args = ()
-    logging.info('SQL: ' + sql.replace('?', '%r') % tuple(args))
+    if enabled(_logger):
+        _logger.debug('SQL: %s', SQLMessage(sql, args), extra=dict(sql=sql, sql_args=args))
 
 
-async def create_pool(loop, **kw):
-    logging.info('creating database connection pool...')
-    global __pool
-    __pool = await aiomysql.create_pool(
+@functools.lru_cache(maxsize=1024)
+def translate_sql(sql):
+    """translate ? placeholders to the %s format of the driver, cached by sql string"""
+    return sql.replace('?', '%s')
+
+
+# 各表总行数缓存：table => [count, reconciled_at]，由 save/remove 增量维护，定期与数据库校准
+_row_counts = dict()
+_count_reconcile_interval = 60
+
+# 当前任务所在事务绑定的连接，由 transaction() 设置
+_tx_conn = contextvars.ContextVar('orm_tx_conn', default=None)
+# 事务中对行数缓存的修改：table => delta，提交后才计入 _row_counts，回滚则丢弃
+_tx_row_deltas = contextvars.ContextVar('orm_tx_row_deltas', default=None)
+
+
+# 读写分离：__pool 为主库连接池，_read_pools 为只读副本连接池
+_read_pools = []
+_read_balance = 'round_robin'
+_read_counter = itertools.count()
+# 当前请求是否已写入主库，写入后的读取也走主库，保证读到自己的写入；由 write_scope() 按请求设置，
+# 值为可变的 dict，gather() 派生的子任务中的写入对整个请求可见
+_has_written = contextvars.ContextVar('orm_has_written', default=None)
+
+
+@contextlib.contextmanager
+def write_scope():
+    """scope read-your-writes stickiness to one request, called by the request middleware"""
+    token = _has_written.set(dict(written=False))
+    try:
+        yield
+    finally:
+        _has_written.reset(token)
+
+
+def _mark_written():
+    scope = _has_written.get()
+    if scope is not None:
+        scope['written'] = True
+
+
+async def _create_pool(loop, **kw):
+    return await aiomysql.create_pool(
         host=kw.get('host', 'localhost'),
         port=kw.get('port', 3306),
         user=kw['user'],
@@ -26,39 +76,171 @@ async def create_pool(loop, **kw):
         )
 
 
-async def select(sql, args, size=None):
-    log(sql, args)
+async def create_pool(loop, **kw):
+    logging.info('creating database connection pool...')
+    global __pool, _read_pools, _read_balance, _count_reconcile_interval
+    _count_reconcile_interval = kw.get('count_reconcile_interval', 60)
+    __pool = await _create_pool(loop, **kw)
+    _read_balance = kw.get('read_balance', 'round_robin')
+    _read_pools = []
+    for replica in kw.get('replicas', ()):
+        logging.info('creating read replica connection pool: %s' % replica.get('host'))
+        _read_pools.append(await _create_pool(loop, **dict(kw, **replica)))
+
+
+def get_pool(readonly=False):
+    """get primary pool for writes, or a read replica pool chosen by read_balance for reads"""
     global __pool
-    async with __pool.acquire() as conn:
-        cur = await conn.cursor(aiomysql.DictCursor)
-        await cur.execute(sql.replace('?', '%s'), args or ())
-        if size:
-            res = await cur.fetchmany(size)
-        else:
-            res = await cur.fetchall()
-        await cur.close()
+    scope = _has_written.get()
+    if not readonly or not _read_pools or (scope is not None and scope['written']):
+        return __pool
+    if _read_balance == 'least_busy':
+        return min(_read_pools, key=lambda p: p.size - p.freesize)
+    return _read_pools[next(_read_counter) % len(_read_pools)]
+
+
+def pool_stats():
+    """size, in use and max size of primary and replica pools"""
+    global __pool
+    pools = [('primary', __pool)] + [('replica%s' % i, p) for i, p in enumerate(_read_pools)]
+    return [dict(name=name, size=p.size, in_use=p.size - p.freesize, maxsize=p.maxsize,
+                 saturation=(p.size - p.freesize) / p.maxsize) for name, p in pools]
+
+
+@contextlib.asynccontextmanager
+async def acquire(pool):
+    """acquire connection from pool, record wait time and saturation"""
+    start = time.perf_counter()
+    async with pool.acquire() as conn:
+        observe('db.pool_wait_ms', (time.perf_counter() - start) * 1000)
+        observe('db.pool_in_use', pool.size - pool.freesize)
+        yield conn
+
+
+@contextlib.asynccontextmanager
+async def connection(readonly=False):
+    """yield the connection bound to current transaction, or acquire one from pool"""
+    conn = _tx_conn.get()
+    if conn is not None:
+        yield conn
+        return
+    if not readonly:
+        _mark_written()
+    async with acquire(get_pool(readonly)) as conn:
+        yield conn
+
+
+def in_transaction():
+    return _tx_conn.get() is not None
+
+
+@contextlib.asynccontextmanager
+async def transaction():
+    """async with transaction(): pin one pooled connection to current task for all ORM calls,
+    commit on exit or rollback on error. nested transaction() joins the outer one."""
+    conn = _tx_conn.get()
+    if conn is not None:
+        yield conn
+        return
+    _mark_written()
+    async with acquire(get_pool()) as conn:
+        await conn.begin()
+        token = _tx_conn.set(conn)
+        deltas = dict()
+        deltas_token = _tx_row_deltas.set(deltas)
+        try:
+            yield conn
+            await conn.commit()
+        except BaseException:
+            await conn.rollback()
+            raise
+        finally:
+            _tx_row_deltas.reset(deltas_token)
+            _tx_conn.reset(token)
+        for table, delta in deltas.items():
+            _adjust_row_count(table, delta)
+
+
+def _adjust_row_count(table, delta):
+    entry = _row_counts.get(table)
+    if entry is not None:
+        entry[0] += delta
+
+
+async def select(sql, args, size=None, tuples=False):
+    """select rows as dicts, or as plain tuples in column order if tuples=True"""
+    log(sql, args)
+    async with connection(readonly=True) as conn:
+        start = time.perf_counter()
+        with span('db'):
+            cur = await conn.cursor(aiomysql.Cursor if tuples else aiomysql.DictCursor)
+            await cur.execute(translate_sql(sql), args or ())
+            if size:
+                res = await cur.fetchmany(size)
+            else:
+                res = await cur.fetchall()
+            await cur.close()
+        observe('db.select_ms', (time.perf_counter() - start) * 1000)
+        observe('db.select_rows', len(res))
 
-        logging.info('rows returned: %s' % len(res))
+        if enabled(_logger):
+            _logger.debug('rows returned: %s', len(res))
         return res
 
 
-async def execute(sql, args, autocommit=True):
+async def iterate(sql, args, batch_size=100):
+    """iterate rows with a server side cursor so memory stays flat regardless of result size"""
     log(sql, args)
-    global __pool
-    async with __pool.acquire() as conn:
-        if not autocommit:
-            await conn.begin()
+    async with connection(readonly=True) as conn:
+        cur = await conn.cursor(aiomysql.SSDictCursor)
         try:
-            cur = await conn.cursor()
-            await cur.execute(sql.replace('?', '%s'), args)
-            affected = cur.rowcount
+            await cur.execute(translate_sql(sql), args or ())
+            while True:
+                rows = await cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
             await cur.close()
-            if not autocommit:
-                await conn.commit()
-        except BaseException as e:
-            if not autocommit:
-                await conn.rollback()
-            raise
+
+
+async def gather(*aws):
+    """run independent queries concurrently, each on its own pooled connection.
+    inside a transaction they share one connection, so they run one by one"""
+    if in_transaction():
+        return [await aw for aw in aws]
+    return await asyncio.gather(*aws)
+
+
+async def execute(sql, args, autocommit=True):
+    log(sql, args)
+    if not autocommit and not in_transaction():
+        async with transaction() as conn:
+            return (await _execute(conn, sql, args))
+    async with connection() as conn:
+        return (await _execute(conn, sql, args))
+
+
+async def _execute(conn, sql, args):
+    start = time.perf_counter()
+    with span('db'):
+        cur = await conn.cursor()
+        await cur.execute(translate_sql(sql), args)
+        affected = cur.rowcount
+        await cur.close()
+    observe('db.execute_ms', (time.perf_counter() - start) * 1000)
+    observe('db.execute_rows', affected)
+    return affected
+
+
+async def execute_many(statements):
+    """execute (sql, args) statements in one transaction, return total affected rows"""
+    async with transaction() as conn:
+        affected = 0
+        for sql, args in statements:
+            log(sql, args)
+            affected += await _execute(conn, sql, args)
         return affected
 
 
@@ -66,21 +248,81 @@ def create_args_string(num):
     return ', '.join(['?'] * num)
 
 
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+
+def create_seek_clause(fields, op):
+    """build keyset condition like (a, b) < (x, y) which can be resolved by index"""
+    clauses = []
+    for i, f in enumerate(fields):
+        conds = ['`%s`=?' % g for g in fields[:i]]
+        conds.append('`%s`%s?' % (f, op))
+        clauses.append('(%s)' % ' and '.join(conds))
+    return '(%s)' % ' or '.join(clauses)
+
+
+def create_seek_args(values):
+    args = []
+    for i in range(len(values)):
+        args.extend(values[:i+1])
+    return args
+
+
+@functools.lru_cache(maxsize=512)
+def compile_select(cls, where, order_by, seek_by, seek, ascending, limit, columns=None):
+    """build select sql of model by query shape, cached so hot queries skip string building"""
+    if columns is None:
+        sql = [cls.__select__]
+    else:
+        sql = ['select %s from `%s`' % (', '.join('`%s`' % c for c in columns), cls.__table__)]
+    if seek_by is not None:
+        if seek:
+            clause = create_seek_clause(seek_by, '>' if ascending else '<')
+            where = '(%s) and %s' % (where, clause) if where else clause
+        order_by = ', '.join('`%s` %s' % (f, 'asc' if ascending else 'desc') for f in seek_by)
+    if where:
+        sql.extend(['where', where])
+    if order_by:
+        sql.extend(['order by', order_by])
+    if limit == 1:
+        sql.append('limit ?')
+    elif limit == 2:
+        sql.append('limit ?, ?')
+    return ' '.join(sql)
+
+
+@functools.lru_cache(maxsize=128)
+def projection_row_class(cls, columns):
+    """row class of model holding only the projected columns"""
+    return create_row_class('%sRow' % cls.__name__, columns)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_number(cls, select_field, where):
+    sql = ['select %s as _num_ from `%s`' % (select_field, cls.__table__)]
+    if where:
+        sql.extend(['where', where])
+    return ' '.join(sql)
+
+
 class Field(object):
     """Base field class"""
-    def __init__(self, name, column_type, primary_key, default):
+    def __init__(self, name, column_type, primary_key, default, index=False):
         self.name = name
         self.column_type = column_type
         self.primary_key = primary_key
         self.default = default
+        self.index = index # True 为普通索引，'unique' 为唯一索引
 
     def __str__(self):
         return '<%s, %s:%s>' % (self.__class__.__name__, self.column_type, self.name)
 
 
 class StringField(Field):
-    def __init__(self, name=None, primary_key=False, default=None, ddl='varchar(100)'):
-        super().__init__(name, ddl, primary_key, default)
+    def __init__(self, name=None, primary_key=False, default=None, ddl='varchar(100)', index=False):
+        super().__init__(name, ddl, primary_key, default, index)
 
 
 class BooleanField(Field):
@@ -89,13 +331,13 @@ class BooleanField(Field):
 
 
 class IntegerField(Field):
-    def __init__(self, name=None, primary_key=False, default=0):
-        super().__init__(name, 'bigint', primary_key, default)
+    def __init__(self, name=None, primary_key=False, default=0, index=False):
+        super().__init__(name, 'bigint', primary_key, default, index)
 
 
 class FloatField(Field):
-    def __init__(self, name=None, primary_key=False, default=0.0):
-        super().__init__(name, 'real', primary_key, default)
+    def __init__(self, name=None, primary_key=False, default=0.0, index=False):
+        super().__init__(name, 'real', primary_key, default, index)
 
 
 class TextField(Field):
@@ -103,6 +345,40 @@ class TextField(Field):
         super().__init__(name, 'text', False, default)
 
 
+class Row(object):
+    """Base class of the compact rows generated for each model: slots in select column order,
+    built straight from a tuple cursor row"""
+    __slots__ = ()
+    __columns__ = ()
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.__columns__
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__columns__}
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, ', '.join('%s=%r' % (k, getattr(self, k)) for k in self.__columns__))
+
+
+def create_row_class(name, columns):
+    """create a Row subclass whose __init__ unpacks a tuple into slots by precomputed offsets"""
+    namespace = dict(__slots__=tuple(columns), __columns__=tuple(columns))
+    # 与 namedtuple 类似，生成 self.a, self.b, ... = row 的 __init__，避免逐个 setattr
+    source = 'def __init__(self, row):\n    %s, = row\n' % ', '.join('self.%s' % c for c in columns)
+    exec(source, namespace)
+    return type(name, (Row,), namespace)
+
+
 class ModelMetaclass(type):
     def __new__(cls, name, bases, attrs):
         # 排除 Model 类本身
@@ -137,6 +413,21 @@ class ModelMetaclass(type):
         attrs['__insert__'] = 'insert into `%s` (%s, `%s`) values (%s)' % (table_name, ', '.join(escaped_fields), primary_key, create_args_string(len(fields)+1))
         attrs['__update__'] = 'update `%s` set %s where `%s`=?' % (table_name, ', '.join(map(lambda f: '`%s`=?' % (mappings.get(f).name or f), fields)), primary_key)
         attrs['__delete__'] = 'delete from `%s` where `%s`=?' % (table_name, primary_key)
+        attrs['__find__'] = '%s where `%s`=?' % (attrs['__select__'], primary_key)
+        # 字段上声明的索引：index name => create index 语句
+        indexes = {
+            'idx_%s' % k: 'create %sindex `idx_%s` on `%s` (`%s`)' % ('unique ' if v.index == 'unique' else '', k, table_name, k)
+            for k, v in mappings.items() if v.index
+        }
+        # 类上声明的组合索引：__indexes__ = [('blog_id', 'created_at')]
+        for columns in attrs.get('__indexes__', ()):
+            for c in columns:
+                if c not in mappings:
+                    raise AttributeError('Index field not found: %s' % c)
+            index_name = 'idx_%s' % '_'.join(columns)
+            indexes[index_name] = 'create index `%s` on `%s` (%s)' % (index_name, table_name, ', '.join('`%s`' % c for c in columns))
+        attrs['__indexes__'] = indexes
+        attrs['__row__'] = create_row_class('%sRow' % name, [primary_key] + fields)
         return type.__new__(cls, name, bases, attrs)
 
 
@@ -149,6 +440,8 @@ class Model(dict, metaclass=ModelMetaclass):
         try:
             return self[key]
         except KeyError:
+            if key in self.__dict__.get('_deferred', ()):
+                raise AttributeError('"%s" field "%s" is deferred, load it by "await obj.load()" first' % (self.__class__.__name__, key))
             raise AttributeError('"%s" object has no attribute "%s"' % (self.__class__.__name__, key))
 
     def __setattr__(self, key, value):
@@ -168,63 +461,225 @@ class Model(dict, metaclass=ModelMetaclass):
         return value
 
     @classmethod
-    async def find_all(cls, where=None, args=None, **kw):
-        """find object by where clause."""
-        sql = [cls.__select__]
-        if where:
-            sql.extend(['where', where])
-        if args is None:
-            args = []
-        order_by = kw.get('order_by', None)
-        if order_by:
-            sql.extend(['order by', order_by])
+    def build_select(cls, where=None, args=None, **kw):
+        """build select sql and args by where clause.
+
+        keyset pagination: pass seek=(created_at, id) of the last seen row (or seek=None for
+        the first page) to get rows after it, ordered by seek_by (default: created_at and
+        primary key) descending, or ascending if ascending=True.
+
+        projection: pass fields=(...) to select only those fields (and the primary key).
+        """
+        args = [] if args is None else list(args)
+        seek_by, seek, ascending = None, None, False
+        if 'seek' in kw:
+            seek = kw['seek']
+            seek_by = tuple(kw.get('seek_by', ('created_at', cls.__primary_key__)))
+            ascending = bool(kw.get('ascending', False))
+            if seek is not None:
+                args.extend(create_seek_args(seek))
         limit = kw.get('limit')
+        nlimit = 0
         if limit is not None:
             if isinstance(limit, int):
-                sql.append('limit ?')
+                nlimit = 1
                 args.append(limit)
             elif isinstance(limit, (tuple, list)) and len(limit) == 2:
-                sql.append('limit ?, ?')
+                nlimit = 2
                 args.extend(limit)
             else:
                 raise ValueError('Invalid limit value: %s' % limit)
-        res = await select(' '.join(sql), args)
-        return [cls(**obj) for obj in res]
+        columns = cls.get_columns(kw.get('fields'))
+        sql = compile_select(cls, where, kw.get('order_by', None), seek_by, seek is not None, ascending, nlimit, columns)
+        return sql, args
+
+    @classmethod
+    def get_columns(cls, fields):
+        """columns of a projection: primary key followed by fields, None for all columns"""
+        if fields is None:
+            return None
+        for f in fields:
+            if f not in cls.__mappings__:
+                raise ValueError('Invalid field for %s: %s' % (cls.__name__, f))
+        return (cls.__primary_key__,) + tuple(f for f in cls.__fields__ if f in fields)
+
+    @classmethod
+    def partial(cls, obj, columns):
+        """create object of a projection, the other fields are deferred"""
+        m = cls(**obj)
+        if columns is not None:
+            object.__setattr__(m, '_deferred', tuple(f for f in cls.__fields__ if f not in columns))
+        return m
+
+    def _check_loaded(self):
+        deferred = self.__dict__.get('_deferred', ())
+        if deferred:
+            raise ValueError('"%s" object has deferred fields %s, load them by "await obj.load()" first' % (self.__class__.__name__, ', '.join(deferred)))
+
+    async def load(self, *fields):
+        """load deferred fields (all of them by default) of a partial object from database"""
+        deferred = self.__dict__.get('_deferred', ())
+        fields = [f for f in (fields or deferred) if f in deferred]
+        if not fields:
+            return self
+        sql = 'select %s from `%s` where `%s`=?' % (', '.join('`%s`' % f for f in fields), self.__table__, self.__primary_key__)
+        res = await select(sql, (self.get_value(self.__primary_key__),), 1)
+        if res:
+            dict.update(self, res[0])
+        object.__setattr__(self, '_deferred', tuple(f for f in deferred if f not in fields))
+        return self
+
+    @classmethod
+    async def find_all(cls, where=None, args=None, **kw):
+        """find object by where clause. see build_select for keyword arguments"""
+        sql, args = cls.build_select(where, args, **kw)
+        res = await select(sql, args)
+        if kw.get('fields') is None:
+            return [cls(**obj) for obj in res]
+        columns = cls.get_columns(kw['fields'])
+        return [cls.partial(obj, columns) for obj in res]
+
+    @classmethod
+    async def find_rows(cls, where=None, args=None, **kw):
+        """find compact read-only rows (cls.__row__) by where clause, for large list queries"""
+        sql, args = cls.build_select(where, args, **kw)
+        res = await select(sql, args, tuples=True)
+        columns = cls.get_columns(kw.get('fields'))
+        row = cls.__row__ if columns is None else projection_row_class(cls, columns)
+        return [row(t) for t in res]
+
+    @classmethod
+    async def iter_all(cls, where=None, args=None, **kw):
+        """iterate objects by where clause with a server side cursor"""
+        sql, args = cls.build_select(where, args, **kw)
+        async for obj in iterate(sql, args):
+            yield cls(**obj)
+
+    @classmethod
+    def is_row_count(cls, select_field):
+        f = select_field.replace(' ', '').replace('`', '').lower()
+        return f in ('count(*)', 'count(1)', 'count(%s)' % cls.__primary_key__.lower())
+
+    @classmethod
+    def adjust_row_count(cls, delta):
+        """incrementally maintain the cached row count of table, deferred to commit inside a transaction"""
+        deltas = _tx_row_deltas.get()
+        if deltas is not None:
+            deltas[cls.__table__] = deltas.get(cls.__table__, 0) + delta
+        else:
+            _adjust_row_count(cls.__table__, delta)
 
     @classmethod
     async def find_number(cls, select_field, where=None, args=None):
-        """find number by select and where"""
-        sql = ['select %s as _num_ from `%s`' % (select_field, cls.__table__)]
-        if where:
-            sql.extend(['where', where])
-        res = await select(' '.join(sql), args, 1)
+        """find number by select and where. total row count of table is served from cache"""
+        if where is None and cls.is_row_count(select_field):
+            entry = _row_counts.get(cls.__table__)
+            if entry is not None and time.time() - entry[1] < _count_reconcile_interval:
+                return entry[0]
+            res = await select('select count(*) as _num_ from `%s`' % cls.__table__, None, 1)
+            _row_counts[cls.__table__] = [res[0]['_num_'], time.time()]
+            return res[0]['_num_']
+        res = await select(compile_number(cls, select_field, where), args, 1)
         if len(res) == 0:
             return None
         return res[0]['_num_']
 
     @classmethod
-    async def find(cls, pk):
-        """find object by primary key."""
-        sql = '%s where `%s`=?' % (cls.__select__, cls.__primary_key__)
-        res = await select(sql, (pk,), 1)
+    async def find(cls, pk, fields=None):
+        """find object by primary key. pass fields=(...) to load only those fields"""
+        if fields is None:
+            res = await select(cls.__find__, (pk,), 1)
+        else:
+            res = await select(compile_select(cls, '`%s`=?' % cls.__primary_key__, None, None, False, False, 0, cls.get_columns(fields)), (pk,), 1)
         if len(res) == 0:
             return None
-        return cls(**res[0])
+        return cls.partial(res[0], cls.get_columns(fields))
+
+    @classmethod
+    async def ensure_indexes(cls):
+        """create indexes declared on fields or in __indexes__ but missing in database. needs the index privilege"""
+        res = await select('show index from `%s`' % cls.__table__, None)
+        existing = set(r['Key_name'] for r in res)
+        created = []
+        for name, ddl in cls.__indexes__.items():
+            if name not in existing:
+                await execute(ddl, None)
+                created.append(name)
+        if created:
+            logging.info('created indexes on %s: %s' % (cls.__table__, ', '.join(created)))
+        return created
+
+    @classmethod
+    async def save_many(cls, objs, chunk_size=500):
+        """insert objects with multi-row values in one transaction, chunk_size rows per statement"""
+        objs = list(objs)
+        statements = []
+        for chunk in chunks(objs, chunk_size):
+            args = []
+            for obj in chunk:
+                args.extend(map(obj.get_value_or_default, cls.__fields__))
+                args.append(obj.get_value_or_default(cls.__primary_key__))
+            values = ', '.join(['(%s)' % create_args_string(len(cls.__fields__) + 1)] * len(chunk))
+            statements.append((cls.__insert__[:cls.__insert__.rindex(' values ')] + ' values ' + values, args))
+        nrow = await execute_many(statements)
+        cls.adjust_row_count(nrow)
+        if nrow != len(objs):
+            logging.warn('failed to insert records: affected rows: %s of %s' % (nrow, len(objs)))
+        return nrow
+
+    @classmethod
+    async def update_many(cls, objs, chunk_size=500):
+        """update objects by primary key in one transaction, chunk_size rows per statement"""
+        objs = list(objs)
+        for obj in objs:
+            obj._check_loaded()
+        pk = cls.__primary_key__
+        statements = []
+        for chunk in chunks(objs, chunk_size):
+            sets, args = [], []
+            for f in cls.__fields__:
+                col = cls.__mappings__[f].name or f
+                sets.append('`%s`=case `%s`%s end' % (col, pk, ' when ? then ?' * len(chunk)))
+                for obj in chunk:
+                    args.extend((obj.get_value(pk), obj.get_value(f)))
+            args.extend(obj.get_value(pk) for obj in chunk)
+            sql = 'update `%s` set %s where `%s` in (%s)' % (cls.__table__, ', '.join(sets), pk, create_args_string(len(chunk)))
+            statements.append((sql, args))
+        nrow = await execute_many(statements)
+        if nrow != len(objs):
+            logging.warn('failed to update records: affected rows: %s of %s' % (nrow, len(objs)))
+        return nrow
+
+    @classmethod
+    async def remove_where(cls, where, args=None):
+        """delete records by where clause in one statement and one transaction"""
+        nrow = await execute('delete from `%s` where %s' % (cls.__table__, where), args, autocommit=False)
+        cls.adjust_row_count(-nrow)
+        return nrow
 
     async def save(self):
         """save object to database"""
+        self._check_loaded()
         args = list(map(self.get_value_or_default, self.__fields__))
         args.append(self.get_value_or_default(self.__primary_key__))
         nrow = await execute(self.__insert__, args)
+        self.adjust_row_count(nrow)
         if nrow != 1:
             logging.warn('failed to insert record: affected rows: %s' % nrow)
         return nrow
 
     async def update(self):
-        """update record by primary key"""
-        args = list(map(self.get_value, self.__fields__))
+        """update record by primary key. deferred fields of a partial object are left untouched"""
+        deferred = self.__dict__.get('_deferred', ())
+        fields = [f for f in self.__fields__ if f not in deferred]
+        if not fields:
+            return 0
+        sql = self.__update__
+        if deferred:
+            sql = 'update `%s` set %s where `%s`=?' % (self.__table__, ', '.join(map(lambda f: '`%s`=?' % (self.__mappings__[f].name or f), fields)), self.__primary_key__)
+        args = list(map(self.get_value, fields))
         args.append(self.get_value(self.__primary_key__))
-        nrow = await execute(self.__update__, args)
+        nrow = await execute(sql, args)
         if nrow != 1:
             logging.warn('failed to update record: affected rows: %s' % nrow)
         return nrow
@@ -233,6 +688,7 @@ class Model(dict, metaclass=ModelMetaclass):
         """delete record by primary key"""
         args = [self.get_value(self.__primary_key__)]
         nrow = await execute(self.__delete__, args)
+        self.adjust_row_count(-nrow)
         if nrow != 1:
             logging.warn('failed to delete record: affected rows: %s' % nrow)
         return nrow
@@ -0,0 +1,72 @@
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+from metrics import Histogram
+
+
+class Sampler(threading.Thread):
+    """Sample the stack of a thread at a fixed interval, counting collapsed stacks"""
+    def __init__(self, thread_id, interval, duration):
+        super().__init__(name='profiler-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.duration = duration
+        self.stacks = collections.Counter()
+        self.samples = 0
+
+    def run(self):
+        deadline = time.perf_counter() + self.duration
+        while time.perf_counter() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse(frame)] += 1
+                self.samples += 1
+            del frame
+            time.sleep(self.interval)
+
+
+def collapse(frame):
+    """collapse stack of frame to 'outer;...;inner' as flamegraph.pl expects"""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+_running = False
+
+
+async def profile(seconds, interval=0.005, lag_interval=0.01):
+    """sample the event loop thread for seconds, measuring event loop lag meanwhile"""
+    global _running
+    if _running:
+        raise RuntimeError('profiler is already running')
+    _running = True
+    try:
+        loop = asyncio.get_event_loop()
+        sampler = Sampler(threading.get_ident(), interval, seconds)
+        sampler.start()
+        logging.info('profiling event loop for %s seconds...' % seconds)
+        # 事件循环延迟：sleep 实际耗时超出预期的部分即被阻塞的时间
+        lags = Histogram()
+        deadline = loop.time() + seconds
+        while loop.time() < deadline:
+            start = loop.time()
+            await asyncio.sleep(lag_interval)
+            lags.observe((loop.time() - start - lag_interval) * 1000)
+        await loop.run_in_executor(None, sampler.join)
+    finally:
+        _running = False
+    return dict(
+        seconds=seconds,
+        samples=sampler.samples,
+        collapsed='\n'.join('%s %d' % (stack, n) for stack, n in sampler.stacks.most_common()),
+        loop_lag_ms=lags.snapshot()
+    )
@@ -0,0 +1,97 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import logging
+import threading
+
+import markdown2
+
+from cache import LRUCache
+from config import configs
+
+
+# 渲染后的博客正文缓存：blog id => (content sha1, html)，模板渲染线程也会访问，需加锁
+_markdown_cache = LRUCache(
+    maxsize=configs.cache.markdown.maxsize,
+    maxweight=configs.cache.markdown.maxbytes,
+    weigh=lambda entry: len(entry[1])
+)
+_markdown_lock = threading.Lock()
+
+# CPU 密集的渲染放到 executor 中执行，信号量限制排队中的渲染数量
+_markdown_executor = None
+_template_executor = None
+_semaphore = None
+
+
+def init_executors(executor='thread', workers=4, max_pending=64):
+    """create executors for rendering. markdown can use a process pool, templates always use threads"""
+    global _markdown_executor, _template_executor, _semaphore
+    logging.info('init render executors: %s x %s' % (executor, workers))
+    _template_executor = concurrent.futures.ThreadPoolExecutor(workers)
+    if executor == 'process':
+        _markdown_executor = concurrent.futures.ProcessPoolExecutor(workers)
+    else:
+        _markdown_executor = _template_executor
+    _semaphore = asyncio.Semaphore(max_pending)
+
+
+async def _run(executor, fn, *args):
+    if _semaphore is None:
+        init_executors(**configs.render)
+    async with _semaphore:
+        return (await asyncio.get_event_loop().run_in_executor(executor or _template_executor, fn, *args))
+
+
+def _digest(text):
+    return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+
+def _get_cached(key, digest):
+    with _markdown_lock:
+        entry = _markdown_cache.get(key)
+    if entry is not None and entry[0] == digest:
+        return entry[1]
+    return None
+
+
+def _put_cached(key, digest, html):
+    with _markdown_lock:
+        _markdown_cache.put(key, (digest, html))
+    logging.debug('markdown rendered and cached: %s' % key)
+
+
+def render_markdown(text, key=None):
+    """render markdown text to html. rendered html is cached by key and content hash if key is given"""
+    if key is None:
+        return markdown2.markdown(text)
+    digest = _digest(text)
+    html = _get_cached(key, digest)
+    if html is None:
+        html = markdown2.markdown(text)
+        _put_cached(key, digest, html)
+    return html
+
+
+async def render_markdown_async(text, key=None):
+    """same as render_markdown, but renders in the markdown executor on cache miss"""
+    digest = _digest(text) if key is not None else None
+    if key is not None:
+        html = _get_cached(key, digest)
+        if html is not None:
+            return html
+    html = await _run(_markdown_executor, markdown2.markdown, text)
+    if key is not None:
+        _put_cached(key, digest, html)
+    return html
+
+
+async def render_template(env, template, context):
+    """render jinja2 template in the template executor"""
+    return (await _run(_template_executor, lambda: env.get_template(template).render(**context)))
+
+
+def invalidate_markdown(key):
+    """drop the rendered html of key from cache"""
+    with _markdown_lock:
+        _markdown_cache.pop(key)
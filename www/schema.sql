@@ -28,6 +28,7 @@ create table blog (
     `summary` varchar(200) not null,
     `content` mediumtext not null,
     `created_at` real not null,
+    `updated_at` real not null,
     key `idx_created_at` (`created_at`),
     primary key (`id`)
 ) engine=innodb default charset=utf8mb4;
@@ -40,6 +41,7 @@ create table comment (
     `user_image` varchar(500) not null,
     `content` mediumtext not null,
     `created_at` real not null,
+    key `idx_blog_id_created_at` (`blog_id`, `created_at`),
     key `idx_created_at` (`created_at`),
     primary key (`id`)
 ) engine=innodb default charset=utf8mb4;
@@ -0,0 +1,91 @@
+import json
+import logging
+
+from apis import Page, CursorPage
+from config import configs
+from orm import Model, Row
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+# 按类型注册的编码函数：type => fn(obj) 返回可直接序列化的 dict/list
+_encoders = dict()
+
+PAGE_FIELDS = ('item_count', 'page_count', 'page_index', 'page_size', 'offset', 'limit', 'has_next', 'has_previous')
+CURSOR_PAGE_FIELDS = ('item_count', 'page_size', 'has_next', 'has_previous', 'next_cursor', 'previous_cursor')
+
+
+def register(cls, encoder):
+    """register encoder for objects of cls which the json backend can not serialize"""
+    _encoders[cls] = encoder
+
+
+def default(o):
+    encoder = _encoders.get(type(o))
+    if encoder is None:
+        for cls, fn in _encoders.items():
+            if isinstance(o, cls):
+                encoder = _encoders[type(o)] = fn
+                break
+    if encoder is not None:
+        return encoder(o)
+    try:
+        return o.__dict__
+    except AttributeError:
+        raise TypeError('Object of type %s is not JSON serializable' % type(o).__name__)
+
+
+register(Page, lambda p: {f: getattr(p, f) for f in PAGE_FIELDS})
+register(CursorPage, lambda p: {f: getattr(p, f) for f in CURSOR_PAGE_FIELDS})
+# Model 是 dict 的子类，各后端本身即可序列化；只有以其它方式传入时才按字段编码
+register(Model, lambda m: {f: m.get(f) for f in m.__mappings__})
+register(Row, lambda r: r.to_dict())
+
+
+def _dumps_json(obj, sort_keys=False):
+    return json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys, default=default).encode('utf8')
+
+
+def _dumps_orjson(obj, sort_keys=False):
+    return orjson.dumps(obj, default=default, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+
+
+def _dumps_ujson(obj, sort_keys=False):
+    try:
+        return ujson.dumps(obj, ensure_ascii=False, sort_keys=sort_keys, default=default).encode('utf8')
+    except TypeError:
+        # 旧版本 ujson 不支持 default
+        return _dumps_json(obj, sort_keys)
+
+
+_backends = dict(json=_dumps_json)
+if orjson is not None:
+    _backends['orjson'] = _dumps_orjson
+if ujson is not None:
+    _backends['ujson'] = _dumps_ujson
+
+
+def select_backend(name='auto'):
+    """select json backend: orjson, ujson, json or auto (the fastest installed one)"""
+    global dumps, backend
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'ujson' if ujson is not None else 'json'
+    if name not in _backends:
+        logging.warning('json backend %s is not installed, use json instead' % name)
+        name = 'json'
+    backend = name
+    dumps = _backends[name]
+    logging.info('use json backend: %s' % name)
+
+
+backend = 'json'
+dumps = _dumps_json
+select_backend(configs.json.backend)
@@ -0,0 +1,90 @@
+import contextlib
+import contextvars
+import heapq
+import itertools
+import time
+
+
+# 当前请求的 trace，由 trace_factory 中间件设置
+_current = contextvars.ContextVar('trace', default=None)
+
+# 最慢的请求：(total_ms, seq, trace dict) 组成的小顶堆
+_slowest = []
+_slowest_size = 50
+_seq = itertools.count()
+
+
+class Trace(object):
+    """Timing of the stages of one request"""
+    __slots__ = ('method', 'path', 'started_at', 'start', 'stages')
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.stages = dict() # stage => [total ms, count]
+
+    def add(self, stage, ms):
+        entry = self.stages.get(stage)
+        if entry is None:
+            self.stages[stage] = [ms, 1]
+        else:
+            entry[0] += ms
+            entry[1] += 1
+
+    def server_timing(self, total):
+        timings = ['%s;dur=%.2f' % (stage, ms) for stage, (ms, _) in self.stages.items()]
+        timings.append('total;dur=%.2f' % total)
+        return ', '.join(timings)
+
+    def to_dict(self, total):
+        return dict(
+            method=self.method,
+            path=self.path,
+            started_at=self.started_at,
+            total_ms=total,
+            stages={stage: dict(ms=ms, count=n) for stage, (ms, n) in self.stages.items()}
+        )
+
+
+def set_slowest_size(size):
+    global _slowest_size
+    _slowest_size = size
+
+
+def start(method, path):
+    """start tracing current request, return a token for finish"""
+    trace = Trace(method, path)
+    return trace, _current.set(trace)
+
+
+def finish(trace, token):
+    """stop tracing, keep the trace if it is one of the slowest, return Server-Timing header value"""
+    _current.reset(token)
+    total = (time.perf_counter() - trace.start) * 1000
+    item = (total, next(_seq), trace)
+    if len(_slowest) < _slowest_size:
+        heapq.heappush(_slowest, item)
+    elif total > _slowest[0][0]:
+        heapq.heapreplace(_slowest, item)
+    return trace.server_timing(total)
+
+
+@contextlib.contextmanager
+def span(stage):
+    """time a stage of current request, nothing is done outside a traced request"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(stage, (time.perf_counter() - start) * 1000)
+
+
+def slowest():
+    """the slowest traced requests, slowest first"""
+    return [trace.to_dict(total) for total, _, trace in sorted(_slowest, key=lambda item: -item[0])]